@@ -43,6 +43,11 @@ class SOCKSv5Error(Exception):
 
     """
     Represents an error while negotiating SOCKSv5.
+
+    If the SOCKS server replied with an error, its reply code (1-8) is
+    available as `code`, otherwise `code` is None.
     """
 
-    pass
+    def __init__(self, message="", code=None):
+        super(SOCKSv5Error, self).__init__(message)
+        self.code = code
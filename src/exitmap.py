@@ -23,12 +23,15 @@ Performs a task over (a subset of) all Tor exit relays.
 import sys
 import os
 import time
+import queue
+import atexit
 import socket
 import pkgutil
 import argparse
 import datetime
 import random
 import logging
+import logging.handlers
 from configparser import ConfigParser
 import functools
 import pwd
@@ -96,6 +99,28 @@ def _validate_directory(path, name="directory", check_parent=False):
     return True
 
 
+def _log_via_queue():
+    """
+    Move the root logger's handlers behind a queue drained by a thread.
+
+    Forked children get the original handlers back.
+    """
+
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers,
+                                              respect_handler_level=True)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    listener.start()
+    atexit.register(listener.stop)
+
+    def restore_handlers():
+        root.handlers = handlers
+
+    os.register_at_fork(after_in_child=restore_handlers)
+
+
 def bootstrap_tor(args):
     """
     Invoke a Tor process which is subsequently used by exitmap.
@@ -265,14 +290,18 @@ def parse_cmd_args():
     return parser.parse_args(remaining_argv)
 
 
+@functools.lru_cache(maxsize=1)
 def get_modules():
     """
-    Return all modules located in "modules/".
+    Return the names of all modules located in "modules/".
+
+    The directory is scanned once per process; the result is a tuple so that
+    the cached value cannot be modified by callers.
     """
 
     modules_path = os.path.dirname(modules.__file__)
 
-    return [name for _, name, _ in pkgutil.iter_modules([modules_path])]
+    return tuple(name for _, name, _ in pkgutil.iter_modules([modules_path]))
 
 
 def main():
@@ -303,6 +332,7 @@ def main():
     logging.basicConfig(format=log_format,
                         level=logging.__dict__[args.verbosity.upper()],
                         filename=args.logfile)
+    _log_via_queue()
 
     log.debug("Command line arguments: %s" % str(args))
 
@@ -355,10 +385,29 @@ def main():
     return 0
 
 
+# Destinations already looked up: {(module, host, port): frozenset}
+_lookup_cache = {}
+
+
 def lookup_destinations(args, module):
     """
     Determine the set of destinations that the module might like to scan.
     This removes redundancies and reduces all hostnames to IP addresses.
+
+    Results are cached per module and command line host and port, so the
+    hostnames are resolved only once per process.
+    """
+    key = (module, args.host, args.port)
+    destinations = _lookup_cache.get(key)
+    if destinations is None:
+        destinations = _lookup_cache[key] = frozenset(
+            _lookup_destinations(args, module))
+    return destinations
+
+
+def _lookup_destinations(args, module):
+    """
+    Resolve the destinations for `lookup_destinations`.
     """
     log.debug("Selecting destinations depending on the module.")
     destinations = set()
@@ -529,9 +578,11 @@ def iter_exit_relays(exit_relays, controller, stats, args):
     # Pre-compute fingerprints list once if using random first hops
     if not args.first_hop:
         cached_consensus_path = os.path.join(args.tor_dir, "cached-consensus")
+        # Already parsed (and memoized) when the exits were selected
+        cached_consensus = relayselector.get_cached_consensus(cached_consensus_path)
         if RELIABLE_FIRST_HOP:
             fingerprints = relayselector.get_fingerprints(
-                cached_consensus_path,
+                cached_consensus,
                 include_flags={stem.Flag.GUARD, stem.Flag.STABLE, stem.Flag.FAST,
                               stem.Flag.RUNNING, stem.Flag.VALID},
                 exclude_flags={stem.Flag.BADEXIT},
@@ -540,7 +591,7 @@ def iter_exit_relays(exit_relays, controller, stats, args):
             )
             log.info("Using %d reliable guards for first hop.", len(fingerprints))
         else:
-            fingerprints = relayselector.get_fingerprints(cached_consensus_path)
+            fingerprints = relayselector.get_fingerprints(cached_consensus)
         fingerprint_set = set(fingerprints)
     
     for i, exit_relay in enumerate(exit_relays):
@@ -30,16 +30,23 @@ Usage:
     exitmap dnshealth                          # Wildcard mode (default)
     exitmap dnshealth -H example.com           # NXDOMAIN mode (fallback)
 """
+import base64
+import itertools
 import json
 import logging
+import operator
 import os
 import re
 import signal
 import socket
 import time
-import uuid
 from collections import Counter
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 import error
 import torsocks
 import util
@@ -68,6 +75,7 @@ FIRST_HOP = os.environ.get("EXITMAP_FIRST_HOP", None)
 
 # Tor Metrics URL template
 TOR_METRICS_URL = "https://metrics.torproject.org/rs.html#details/{}"
+_METRICS_PREFIX = TOR_METRICS_URL.replace("{}", "")
 
 # SOCKS error code to status mapping
 _SOCKS_ERROR_MAP = {
@@ -94,9 +102,24 @@ _SOCKS_ERROR_MESSAGES = {
     8: "DNS Error: SOCKS 8 - Address type not supported",
 }
 
+# (status, message) per SOCKS error code, indexed by the code itself
+_SOCKS_ERROR_TABLE = (None,) + tuple(
+    (_SOCKS_ERROR_MAP[code], _SOCKS_ERROR_MESSAGES[code]) for code in range(1, 9))
+_SOCKS_ERROR_UNKNOWN = ("socks_error", "DNS Error: SOCKS None - Unknown error")
+
 # Regex to extract SOCKS error code (compiled once)
 _SOCKS_ERROR_RE = re.compile(r"(?:error\s*|0x0)([1-8])", re.IGNORECASE)
 
+# Query tokens are a random 128-bit seed offset by the process ID and a
+# per-process counter: unique across the forked probe processes of a run and
+# unpredictable across runs, without reading the system RNG for every query
+_QUERY_SEED = int.from_bytes(os.urandom(16), "big")
+_QUERY_MASK = (1 << 128) - 1
+_query_counter = itertools.count()
+
+# Fetches (fingerprint, nickname, address) from a relay descriptor in one call
+_relay_fields = operator.attrgetter("fingerprint", "nickname", "address")
+
 
 def _fmt_first_hop(first_hop):
     """Format first hop for error messages. Returns full 40-char fingerprint or '<random>'."""
@@ -105,9 +128,14 @@ def _fmt_first_hop(first_hop):
     return "<random>"
 
 
+def _hop_suffix(first_hop):
+    """Return the ' (first_hop=...)' suffix appended to error messages."""
+    return " (first_hop=%s)" % _fmt_first_hop(first_hop)
+
+
 def _fmt_with_hop(msg, first_hop):
     """Append first hop fingerprint to message. Always shows first hop (specific or random)."""
-    return "%s (first_hop=%s)" % (msg, _fmt_first_hop(first_hop))
+    return msg + _hop_suffix(first_hop)
 
 
 def _fmt_exception(err):
@@ -142,14 +170,14 @@ class _AlarmContext:
     def __enter__(self):
         try:
             self.old_handler = signal.signal(signal.SIGALRM, _timeout_handler)
-            signal.alarm(self.timeout)
+            signal.setitimer(signal.ITIMER_REAL, self.timeout)
         except (ValueError, AttributeError):
             pass  # Not on Unix or in wrong thread
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         try:
-            signal.alarm(0)
+            signal.setitimer(signal.ITIMER_REAL, 0)
             if self.old_handler is not None:
                 signal.signal(signal.SIGALRM, self.old_handler)
         except (ValueError, AttributeError):
@@ -157,11 +185,17 @@ class _AlarmContext:
         return False  # Don't suppress exceptions
 
 
+# Converters to str for the value types a resolve can return, keyed by type
+_IP_NORMALIZERS = {
+    str: lambda value: value,
+    bytes: lambda value: value.decode("utf-8", "replace"),
+    type(None): lambda value: None,
+}
+
+
 def _normalize_ip(value):
     """Normalize IP to string."""
-    if isinstance(value, bytes):
-        return value.decode("utf-8", "replace")
-    return value if value is None else str(value)
+    return _IP_NORMALIZERS.get(type(value), str)(value)
 
 
 def _parse_socks_error_code(err_str):
@@ -174,15 +208,30 @@ def _parse_socks_error_code(err_str):
     return None
 
 
+def _socks_error_code(err):
+    """Return SOCKS error code (1-8) of a SOCKSv5Error, or None."""
+    code = err.code
+    if code is None:
+        # Raised without a reply code - fall back to parsing the message
+        return _parse_socks_error_code(str(err))
+    return code if 1 <= code <= 8 else None
+
+
 def _make_result(exit_desc, domain, expected_ip, status="unknown",
                  resolved_ip=None, timing=None, error_msg=None, attempt=0, first_hop=None):
     """Create result dict - single source of truth for result structure."""
-    fp = exit_desc.fingerprint
+    try:
+        fp, nickname, address = _relay_fields(exit_desc)
+    except AttributeError:
+        # Descriptor lacks optional fields
+        fp = exit_desc.fingerprint
+        nickname = getattr(exit_desc, "nickname", "unknown")
+        address = getattr(exit_desc, "address", "unknown")
     return {
         "exit_fingerprint": fp,
-        "exit_nickname": getattr(exit_desc, "nickname", "unknown"),
-        "exit_address": getattr(exit_desc, "address", "unknown"),
-        "tor_metrics_url": TOR_METRICS_URL.format(fp),
+        "exit_nickname": nickname,
+        "exit_address": address,
+        "tor_metrics_url": _METRICS_PREFIX + fp,
         "query_domain": domain,
         "expected_ip": expected_ip,
         "timestamp": time.time(),
@@ -197,9 +246,9 @@ def _make_result(exit_desc, domain, expected_ip, status="unknown",
     }
 
 
-def _elapsed_ms(start_time):
-    """Calculate elapsed time in milliseconds."""
-    return int((time.time() - start_time) * 1000)
+def _elapsed_ms(start_ns):
+    """Calculate elapsed time in milliseconds since a time.monotonic_ns() reading."""
+    return (time.monotonic_ns() - start_ns) // 1_000_000
 
 
 def _make_timing(total_start):
@@ -211,24 +260,33 @@ def _make_timing(total_start):
     The total_ms includes: socket creation + Tor circuit + DNS resolution.
     
     Args:
-        total_start: Time when measurement began
+        total_start: time.monotonic_ns() reading taken when measurement began
     
     Returns:
         dict with total_ms
     """
-    now = time.time()
-    total_ms = int((now - total_start) * 1000) if total_start else None
+    total_ms = _elapsed_ms(total_start) if total_start is not None else None
     return {"total_ms": total_ms}
 
 
+def _dump_json(obj, path):
+    """Write `obj` as JSON to `path`, using orjson if it is installed."""
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(obj))
+    else:
+        with open(path, "w") as f:
+            json.dump(obj, f)  # No indent for speed
+
+
 def _write_result(result, fingerprint):
     """Write result to JSON file."""
+    # Synchronous: each forked probe writes one result, so nothing to batch.
     if not util.analysis_dir:
         return
     try:
-        path = os.path.join(util.analysis_dir, "dnshealth_%s.json" % fingerprint)
-        with open(path, "w") as f:
-            json.dump(result, f)  # No indent for speed
+        _dump_json(result, os.path.join(util.analysis_dir,
+                                        "dnshealth_%s.json" % fingerprint))
     except Exception as e:
         log.error("Failed to write result for %s: %s", fingerprint, e)
 
@@ -253,27 +311,47 @@ def setup(consensus=None, target=None, **kwargs):
         log.info("Analysis dir: %s", util.analysis_dir)
 
 
+def _query_token():
+    """Return a fresh 26-character lowercase base32 token for a DNS query."""
+    nonce = (_QUERY_SEED + (os.getpid() << 64) + next(_query_counter)) & _QUERY_MASK
+    return base64.b32encode(nonce.to_bytes(16, "big")).rstrip(b"=").decode("ascii").lower()
+
+
 def generate_unique_query(fingerprint, base_domain):
-    """Generate unique DNS query: {uuid}.{fp_prefix}.{base_domain}"""
-    return "%s.%s.%s" % (uuid.uuid4().hex, fingerprint[:8].lower(), base_domain)
+    """Generate unique DNS query: {token}.{fp_prefix}.{base_domain}
+
+    The 128-bit token is base32-encoded (26 chars instead of 32 hex chars)
+    to keep the query small.  Lowercase base32 only uses characters valid in
+    DNS labels and survives case-folding middleboxes.
+    """
+    return f"{_query_token()}.{fingerprint[:8].lower()}.{base_domain}"
+
 
+def resolve_with_retry(exit_desc, domain, expected_ip=None, retries=MAX_RETRIES, first_hop=None,
+                       result=None):
+    """Resolve domain through exit relay with retry logic.
 
-def resolve_with_retry(exit_desc, domain, expected_ip=None, retries=MAX_RETRIES, first_hop=None):
-    """Resolve domain through exit relay with retry logic."""
+    If `result` is given, it is filled in place so that the caller still
+    holds the partial result if the probe is interrupted.
+    """
     exit_url = exiturl(exit_desc.fingerprint)
-    result = _make_result(exit_desc, domain, expected_ip, first_hop=first_hop)
+    if result is None:
+        result = _make_result(exit_desc, domain, expected_ip, first_hop=first_hop)
+    # Error messages are invariant across attempts - build them once
+    hop_suffix = _hop_suffix(first_hop)
+    timeout_msg = "DNS Error: Timeout after %ds%s" % (QUERY_TIMEOUT, hop_suffix)
 
     for attempt in range(1, retries + 1):
         result["attempt"] = attempt
-        sock = None
-        total_start = time.time()
+        total_start = time.monotonic_ns()
         status = error_msg = None
 
         try:
-            sock = torsocks.torsocket()
-            sock.settimeout(QUERY_TIMEOUT)
-            ip = _normalize_ip(sock.resolve(domain))
-            
+            # Socket is closed on leaving the block, whether or not we fail
+            with torsocks.torsocket() as sock:
+                sock.settimeout(QUERY_TIMEOUT)
+                ip = _normalize_ip(sock.resolve(domain))
+
             result["resolved_ip"] = ip
             result["timing"] = _make_timing(total_start)
 
@@ -293,8 +371,7 @@ def resolve_with_retry(exit_desc, domain, expected_ip=None, retries=MAX_RETRIES,
         except error.SOCKSv5Error as err:
             # SOCKS error - DNS was attempted but failed
             result["timing"] = _make_timing(total_start)
-            err_str = str(err)
-            err_code = _parse_socks_error_code(err_str)
+            err_code = _socks_error_code(err)
 
             # NXDOMAIN (error 4) - not a retry-able error
             if err_code == 4:
@@ -309,31 +386,30 @@ def resolve_with_retry(exit_desc, domain, expected_ip=None, retries=MAX_RETRIES,
                 return result
 
             # Other SOCKS errors - use descriptive messages with first hop
-            status = _SOCKS_ERROR_MAP.get(err_code, "socks_error")
-            base_msg = _SOCKS_ERROR_MESSAGES.get(err_code, f"DNS Error: SOCKS {err_code} - Unknown error")
-            error_msg = _fmt_with_hop(base_msg, first_hop)
+            # _socks_error_code only returns None or a code from 1 to 8
+            status, base_msg = (_SOCKS_ERROR_TABLE[err_code] if err_code is not None
+                                else _SOCKS_ERROR_UNKNOWN)
+            error_msg = base_msg + hop_suffix
 
         except socket.timeout:
             status = "timeout"
-            error_msg = _fmt_with_hop("DNS Error: Timeout after %ds" % QUERY_TIMEOUT, first_hop)
+            error_msg = timeout_msg
 
         except EOFError:
             status = "eof_error"
-            error_msg = _fmt_with_hop("DNS Error: Connection closed unexpectedly", first_hop)
+            error_msg = "DNS Error: Connection closed unexpectedly" + hop_suffix
 
         except FileNotFoundError:
             # Tor SOCKS socket gone - process likely crashed
             status = "tor_connection_lost"
-            error_msg = _fmt_with_hop(
-                "DNS Error: Lost connection to Tor (socket gone) while testing exit %s" % exit_desc.fingerprint[:8],
-                first_hop)
+            error_msg = ("DNS Error: Lost connection to Tor (socket gone) while testing exit %s%s"
+                         % (exit_desc.fingerprint[:8], hop_suffix))
 
         except ConnectionRefusedError:
             # Tor not accepting connections
             status = "tor_connection_refused"
-            error_msg = _fmt_with_hop(
-                "DNS Error: Tor refused connection (may be restarting) while testing exit %s" % exit_desc.fingerprint[:8],
-                first_hop)
+            error_msg = ("DNS Error: Tor refused connection (may be restarting) while testing exit %s%s"
+                         % (exit_desc.fingerprint[:8], hop_suffix))
 
         except HardTimeoutError:
             # Let hard timeout propagate to do_validation handler
@@ -343,14 +419,6 @@ def resolve_with_retry(exit_desc, domain, expected_ip=None, retries=MAX_RETRIES,
             status = "exception"
             error_msg = _fmt_exception(err)
 
-        finally:
-            # Ensure socket is closed even on error
-            if sock is not None:
-                try:
-                    sock.close()
-                except Exception:
-                    pass
-
         # Common error handling for non-SOCKS errors (only if status was set)
         if status is not None:
             result["timing"] = _make_timing(total_start)
@@ -367,21 +435,22 @@ def resolve_with_retry(exit_desc, domain, expected_ip=None, retries=MAX_RETRIES,
 def do_validation(exit_desc, query_domain, expected_ip, first_hop=None):
     """Perform DNS validation with hard timeout protection."""
     fp = exit_desc.fingerprint
+    result = _make_result(exit_desc, query_domain, expected_ip, first_hop=first_hop)
 
     with _AlarmContext(HARD_TIMEOUT):
         try:
-            result = resolve_with_retry(exit_desc, query_domain, expected_ip, first_hop=first_hop)
+            resolve_with_retry(exit_desc, query_domain, expected_ip, first_hop=first_hop,
+                               result=result)
         except HardTimeoutError:
             log.error("HARD_TIMEOUT %s exceeded %ds (first_hop=%s)", 
                       exiturl(fp), HARD_TIMEOUT, _fmt_first_hop(first_hop))
-            # Hard timeout - we don't know where time was spent
-            hard_timing = {"total_ms": HARD_TIMEOUT * 1000, "socket_ms": None, "dns_ms": None}
-            result = _make_result(exit_desc, query_domain, expected_ip,
-                                  status="hard_timeout",
-                                  timing=hard_timing,
-                                  error_msg=_fmt_with_hop("DNS Error: Hard timeout after %ds" % HARD_TIMEOUT, first_hop),
-                                  attempt=MAX_RETRIES,
-                                  first_hop=first_hop)
+            # Hard timeout - we don't know where time was spent.  Only the
+            # per-attempt fields of the in-progress result need resetting.
+            result["status"] = "hard_timeout"
+            result["resolved_ip"] = None
+            result["timing"] = {"total_ms": HARD_TIMEOUT * 1000, "socket_ms": None, "dns_ms": None}
+            result["error"] = _fmt_with_hop("DNS Error: Hard timeout after %ds" % HARD_TIMEOUT, first_hop)
+            result["attempt"] = MAX_RETRIES
         except Exception as e:
             error_msg = _fmt_exception(e)
             log.error("EXCEPTION %s: %s (first_hop=%s)", 
@@ -411,8 +480,8 @@ def _write_circuit_failures(stats):
     
     # Count unresolved failures (circuits that failed but couldn't be mapped to a relay)
     failed_relays = stats.get_failed_circuit_relays()
-    unresolved_failures = sum(1 for fp in failed_relays if fp.startswith("UNRESOLVED_"))
-    resolved_failures = len(failed_relays) - unresolved_failures
+    unresolved_failures = len(stats.get_unresolved_failures())
+    resolved_failures = len(failed_relays)
     
     # Write scan_stats.json - source of truth for circuit counts
     scan_stats = {
@@ -426,56 +495,48 @@ def _write_circuit_failures(stats):
     }
     
     try:
-        with open(os.path.join(util.analysis_dir, "scan_stats.json"), "w") as f:
-            json.dump(scan_stats, f)
+        _dump_json(scan_stats, os.path.join(util.analysis_dir, "scan_stats.json"))
         log.info("Scan stats: %d total, %d successful, %d failed",
                  stats.total_circuits, stats.successful_circuits, stats.failed_circuits)
     except Exception as e:
         log.error("Failed to write scan stats: %s", e)
     
+    if unresolved_failures > 0:
+        log.warning("Skipped %d unresolved circuit failures (no fingerprint)",
+                    unresolved_failures)
+
     # Write individual circuit failures if we have fingerprints
-    failed_relays = stats.get_failed_circuit_relays()
     if not failed_relays:
         log.debug("No circuit failure fingerprints captured")
         return stats.failed_circuits
     
-    # Build failure entries (skip unresolved circuits without valid fingerprints)
-    unresolved_count = 0
+    # Build failure entries (unresolved circuits have no fingerprint to report)
     failures = []
     for fp, info in failed_relays.items():
-        # Skip unresolved failures (placeholder fingerprints starting with UNRESOLVED_)
-        if fp.startswith("UNRESOLVED_"):
-            unresolved_count += 1
-            continue
-        
         failures.append({
             "exit_fingerprint": fp,
             "exit_nickname": "unknown",
             "exit_address": "unknown",
-            "tor_metrics_url": TOR_METRICS_URL.format(fp),
+            "tor_metrics_url": _METRICS_PREFIX + fp,
             "status": "relay_unreachable",
-            "circuit_reason": info["reason_key"],
-            "error": info["error"],
-            "tor_reason": info["tor_reason"],
-            "timestamp": info["timestamp"],
+            "circuit_reason": info.reason_key,
+            "error": info.error,
+            "tor_reason": info.tor_reason,
+            "timestamp": info.timestamp / 1e9,  # ns -> s, like probe results
             "query_domain": None,
             "expected_ip": None,
             "resolved_ip": None,
             "timing": None,
             "run_id": _run_id,
             "mode": None,
-            "first_hop": info.get("first_hop"),
+            "first_hop": info.first_hop,
             "first_hop_nickname": "unknown",
             "first_hop_address": "unknown",
             "attempt": None,
         })
     
-    if unresolved_count > 0:
-        log.warning("Skipped %d unresolved circuit failures (no fingerprint)" % unresolved_count)
-    
     try:
-        with open(os.path.join(util.analysis_dir, "circuit_failures.json"), "w") as f:
-            json.dump(failures, f)
+        _dump_json(failures, os.path.join(util.analysis_dir, "circuit_failures.json"))
         log.info("Wrote %d circuit failures to circuit_failures.json", len(failures))
     except Exception as e:
         log.error("Failed to write circuit failures: %s", e)
@@ -491,7 +552,7 @@ def _write_terminated_relays(relays):
         _write_result({
             "exit_fingerprint": fp, "status": "timeout", "run_id": _run_id,
             "error": "DNS Error: Timeout (terminated during retry)",
-            "timestamp": time.time(), "tor_metrics_url": TOR_METRICS_URL.format(fp),
+            "timestamp": time.time(), "tor_metrics_url": _METRICS_PREFIX + fp,
         }, fp)
     return len(relays)
 
@@ -501,14 +562,20 @@ def teardown(stats=None, controller=None, terminated_relays=None, **kwargs):
     circuit_failures = _write_circuit_failures(stats) if stats else 0
     terminated = _write_terminated_relays(terminated_relays)
     if terminated:
-        _status_counts["timeout"] = _status_counts.get("timeout", 0) + terminated
+        _status_counts["timeout"] += terminated
     
-    total, success = sum(_status_counts.values()), _status_counts.get("success", 0)
+    total, success = sum(_status_counts.values()), _status_counts["success"]
     log.info("=" * 60)
     log.info("DNS HEALTH SCAN COMPLETE | %s | %d total | %d success (%.1f%%)",
              _run_id, total, success, (success / total * 100) if total else 0)
     log.info("Breakdown: %s", dict(_status_counts))
-    if circuit_failures: log.info("Circuit failures: %d", circuit_failures)
+    if circuit_failures:
+        log.info("Circuit failures: %d", circuit_failures)
+        reasons, first_hops = stats.failure_breakdown()
+        log.info("Circuit failure reasons: %s", dict(reasons.most_common()))
+        if first_hops:
+            log.info("Most failing first hops: %s",
+                     ", ".join("%s (%d)" % (fp[:8], n) for fp, n in first_hops))
     if terminated: log.info("Terminated during retry: %d", terminated)
     if util.analysis_dir: log.info("Results: %s", util.analysis_dir)
     log.info("=" * 60)
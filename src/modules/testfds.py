@@ -36,11 +36,11 @@ log = logging.getLogger(__name__)
 
 destinations = [("people.torproject.org", 443)]
 
+_EXPECTED_RESPONSE_RE = re.compile("This file is to check if your exit relay "
+                                   "has enough file descriptors to fetch it.")
 
-def fetch_page(exit_desc):
 
-    expected = "This file is to check if your exit relay has enough file " \
-               "descriptors to fetch it."
+def fetch_page(exit_desc):
 
     exit_url = exiturl(exit_desc.fingerprint)
 
@@ -61,7 +61,7 @@ def fetch_page(exit_desc):
 
     data = data.strip()
 
-    if not re.match(expected, data):
+    if not _EXPECTED_RESPONSE_RE.match(data):
         log.warning("Got unexpected response from %s: %s." % (exit_url, data))
     else:
         log.debug("Exit relay %s worked fine." % exit_url)
@@ -26,6 +26,7 @@ import os
 import sys
 import argparse
 import logging
+import functools
 
 import stem
 import stem.descriptor
@@ -68,7 +69,7 @@ def parse_cmd_args():
     return parser.parse_args()
 
 
-def get_fingerprints(cached_consensus_path, exclude=[],
+def get_fingerprints(cached_consensus, exclude=[],
                      include_flags=None, exclude_flags=None,
                      min_bandwidth_kb=None, require_measured_bw=False,
                      include_country=None):
@@ -76,7 +77,8 @@ def get_fingerprints(cached_consensus_path, exclude=[],
     Get relay fingerprints from consensus, optionally filtered.
 
     Args:
-        cached_consensus_path: Path to cached-consensus file
+        cached_consensus: Path to cached-consensus file, or the dict
+            returned by get_cached_consensus() to avoid parsing it again
         exclude: List of fingerprints to exclude
         include_flags: Set of stem.Flag relay MUST have ALL of
         exclude_flags: Set of stem.Flag relay must have NONE of
@@ -93,7 +95,12 @@ def get_fingerprints(cached_consensus_path, exclude=[],
     if include_country:
         country_relays = frozenset(util.get_relays_in_country(include_country))
 
-    for desc in stem.descriptor.parse_file(cached_consensus_path):
+    if isinstance(cached_consensus, dict):
+        router_statuses = cached_consensus.values()
+    else:
+        router_statuses = stem.descriptor.parse_file(cached_consensus)
+
+    for desc in router_statuses:
         if desc.fingerprint in exclude:
             continue
         if include_flags and not include_flags.issubset(desc.flags):
@@ -154,13 +161,24 @@ def router_statuses_with_exit_flag(cached_consensus):
     return have_exit_flag
 
 
+@functools.lru_cache(maxsize=1)
+def _parse_cached_consensus(cached_consensus_path, mtime_ns):
+    """Parse "cached_consensus"; memoized on the file's path and mtime."""
+    cached_consensus = {}
+    for desc in stem.descriptor.parse_file(cached_consensus_path):
+        cached_consensus[desc.fingerprint] = desc
+    return cached_consensus
+
+
 def get_cached_consensus(cached_consensus_path):
-    """Read relays' summarized descriptors from "cached_consensus"."""
+    """Read relays' summarized descriptors from "cached_consensus".
+
+    The parsed consensus is cached until the file changes, so the returned
+    dict is shared between callers and must not be modified.
+    """
     try:
-        cached_consensus = {}
-        for desc in stem.descriptor.parse_file(cached_consensus_path):
-            cached_consensus[desc.fingerprint] = desc
-        return cached_consensus
+        mtime_ns = os.stat(cached_consensus_path).st_mtime_ns
+        return _parse_cached_consensus(cached_consensus_path, mtime_ns)
 
     except IOError as err:
         log.critical("File \"%s\" could not be read: %s" %
@@ -222,6 +240,26 @@ def get_exits(data_dir,
     log.info("The consensus is valid after: %s" %
              next(iter(cached_consensus.values())).document.valid_after)
     have_exit_policy = get_exit_policies(cached_descriptors_path)
+
+    return _select_exits(cached_consensus, have_exit_policy,
+                         good_exit=good_exit, bad_exit=bad_exit,
+                         version=version, nickname=nickname, address=address,
+                         country_code=country_code,
+                         requested_exits=requested_exits,
+                         destinations=destinations)
+
+
+def _select_exits(cached_consensus, have_exit_policy,
+                  good_exit=True, bad_exit=False,
+                  version=None, nickname=None, address=None, country_code=None,
+                  requested_exits=None, destinations=None):
+    """Select exit relays from an already-loaded consensus and exit policies.
+
+    `cached_consensus' is the dict returned by get_cached_consensus() and
+    `have_exit_policy' the one returned by get_exit_policies().  The other
+    arguments and the return value are as for get_exits(), which loads both
+    from Tor's data directory and then calls this function.
+    """
     log.debug("Number of relays with exit policy: %s", len(have_exit_policy))
     have_exit_flag = router_statuses_with_exit_flag(cached_consensus)
 
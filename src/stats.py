@@ -20,13 +20,39 @@
 Provides functions to keep track of scanning statistics.
 """
 
+import functools
 import logging
-from datetime import datetime
+import os
+import sys
+import time
+from collections import Counter, OrderedDict
+from typing import NamedTuple
 
 from stem import CircStatus
 
 log = logging.getLogger(__name__)
 
+# Timestamps are taken on every circuit event, so they are kept as integer
+# nanoseconds since the epoch and only converted to seconds when written out.
+_now = time.time_ns
+
+# Upper bound on the circuit registry.  Circuits whose events never arrive
+# (e.g., stem dropped them) are evicted oldest-first once this is reached.
+# Can be overridden via MAX_REGISTERED_CIRCUITS environment variable
+MAX_REGISTERED_CIRCUITS = int(os.environ.get("MAX_REGISTERED_CIRCUITS", "10000"))
+
+# Warn (once) if more than this fraction of failed circuits could not be
+# mapped to a relay, after at least UNRESOLVED_MIN_FAILURES failures.
+UNRESOLVED_WARN_RATIO = 0.05
+UNRESOLVED_MIN_FAILURES = 100
+
+# Circuit statuses handled by update_circs, bound once at import
+_FAILED = CircStatus.FAILED
+_BUILT = CircStatus.BUILT
+
+# Seconds for which __str__ may return its previous summary
+_STR_CACHE_TTL = 0.5
+
 # Mapping from Tor circuit failure reasons to friendly JSON keys and error messages
 # Reference: https://spec.torproject.org/control-spec/replies.html#circuit-status-changed
 CIRCUIT_FAILURE_MAP = {
@@ -60,14 +86,56 @@ CIRCUIT_FAILURE_MAP = {
 }
 
 
+# Failure details per reason, extended with the reason string reported in
+# the "tor_reason" field: {reason: (key, message, tor_reason)}
+_failure_get = {reason: info + (reason,)
+                for reason, info in CIRCUIT_FAILURE_MAP.items()}.get
+
+
+# The set of reasons Tor reports is small, so the cache stays warm and the
+# "unknown failure" messages are formatted once per reason.
+@functools.lru_cache(maxsize=256)
 def get_circuit_failure_info(reason):
     """
-    Convert Tor circuit failure reason to JSON key and friendly error message.
+    Convert Tor circuit failure reason to JSON key, friendly error message
+    and the reason string to report, which is always upper case.
     """
-    reason_str = str(reason).upper() if reason else "UNKNOWN"
-    if reason_str in CIRCUIT_FAILURE_MAP:
-        return CIRCUIT_FAILURE_MAP[reason_str]
-    return ("circuit_failed", "Tor Circuit Error: Unknown failure (%s)" % reason_str)
+    if not reason:
+        return ("circuit_failed", "Tor Circuit Error: Unknown failure (UNKNOWN)",
+                "UNKNOWN")
+    reason_str = str(reason)
+    # Tor reports reasons in upper case already; only convert when needed
+    upper = reason_str if reason_str.isupper() else reason_str.upper()
+    info = _failure_get(upper)
+    if info is not None:
+        return info
+    return ("circuit_failed", "Tor Circuit Error: Unknown failure (%s)" % upper,
+            upper)
+
+
+class PendingCircuit(NamedTuple):
+
+    """
+    Intended path of a circuit we asked Tor to build.
+    """
+
+    first_hop: str
+    exit_relay: str
+    timestamp: int  # nanoseconds since the epoch
+
+
+class FailedCircuit(NamedTuple):
+
+    """
+    Details of a circuit that failed to build.
+    """
+
+    reason_key: str
+    error: str
+    tor_reason: str
+    first_hop: object
+    timestamp: int  # nanoseconds since the epoch
+    unresolved: bool = False
 
 
 class Statistics(object):
@@ -76,23 +144,47 @@ class Statistics(object):
     Keep track of scanning statistics.
     """
 
-    def __init__(self):
+    def __init__(self, max_registered=MAX_REGISTERED_CIRCUITS):
         """
         Initialise a Statistics object.
         """
 
-        self.start_time = datetime.now()
+        self._start_monotonic = time.monotonic()
+        # Circuit counters count events, not relays: an exit whose circuit
+        # fails twice adds two to failed_circuits but one failure record.
         self.total_circuits = 0
         self.failed_circuits = 0
         self.successful_circuits = 0
         self.modules_run = 0
         self.finished_streams = 0
         self.failed_streams = 0
-        # Track failed circuit details: {exit_fingerprint: {...}}
+        # Track failed circuit details: {exit_fingerprint: FailedCircuit}
         self.failed_circuit_relays = {}
-        # Circuit registry: {circuit_id: {"first_hop": fpr, "exit_relay": fpr, "timestamp": ...}}
-        # This allows us to know the intended path even when Tor doesn't report it on failure
-        self.pending_circuits = {}
+        # Failures of circuits that were not in the registry, so no exit
+        # fingerprint is known: [FailedCircuit]
+        self.unresolved_failures = []
+        # Circuit registry: {circuit_id: PendingCircuit}
+        # This allows us to know the intended path even when Tor doesn't report it on failure.
+        # Circuit IDs are used as given by stem, which reports them as strings.
+        # Insertion-ordered so the oldest entries can be evicted.
+        self.pending_circuits = OrderedDict()
+        self.max_registered = max_registered
+        # Counters driving the periodic progress log lines
+        self._registered_count = 0
+        self._failure_log_count = 0
+        # Failed circuits that could / could not be mapped to their exit relay
+        self._resolved_count = 0
+        self._unresolved_count = 0
+        self._unresolved_warned = False
+        # Last summary returned by __str__: (counters, time, string)
+        self._str_cache = None
+        # Failure events per reason key and per known first hop, for
+        # failure_breakdown
+        self._failure_reasons = Counter()
+        self._failure_first_hops = Counter()
+        # Circuit event handlers by status; other statuses are ignored
+        self._circ_handlers = {_FAILED: self._circ_failed,
+                               _BUILT: self._circ_built}
 
     def register_circuit(self, circuit_id, first_hop, exit_relay):
         """
@@ -103,15 +195,20 @@ class Statistics(object):
             first_hop: Fingerprint of the first hop (guard) relay
             exit_relay: Fingerprint of the exit relay
         """
-        cid = str(circuit_id)  # Normalize to string for consistent lookup
-        self.pending_circuits[cid] = {
-            "first_hop": first_hop,
-            "exit_relay": exit_relay,
-            "timestamp": datetime.now().timestamp()
-        }
-        log.debug("Registered circuit %s: %s -> %s" % (cid, first_hop[:8], exit_relay[:8]))
-        if len(self.pending_circuits) % 100 == 0:
-            log.info("Circuit registry: %d circuits registered" % len(self.pending_circuits))
+        # The same first hop recurs across many circuits; interning keeps one
+        # copy of each fingerprint alive for all registry and failure records.
+        first_hop = sys.intern(first_hop)
+        exit_relay = sys.intern(exit_relay)
+        pending = self.pending_circuits
+        pending[circuit_id] = PendingCircuit(first_hop, exit_relay, _now())
+        if len(pending) > self.max_registered:
+            evicted, _ = pending.popitem(last=False)
+            log.debug("Circuit registry full, evicted circuit %s", evicted)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Registered circuit %s: %s -> %s", circuit_id, first_hop[:8], exit_relay[:8])
+        self._registered_count += 1
+        if self._registered_count % 100 == 0:
+            log.info("Circuit registry: %d circuits registered", self._registered_count)
 
     def resolve_circuit(self, circuit_id):
         """
@@ -120,110 +217,185 @@ class Statistics(object):
         Returns:
             Tuple of (first_hop, exit_relay) or (None, None) if not found
         """
-        info = self.pending_circuits.get(str(circuit_id))
-        return (info["first_hop"], info["exit_relay"]) if info else (None, None)
+        info = self.pending_circuits.get(circuit_id)
+        return (info.first_hop, info.exit_relay) if info else (None, None)
 
     def complete_circuit(self, circuit_id):
         """Remove a circuit from the pending registry (it completed or failed)."""
-        self.pending_circuits.pop(str(circuit_id), None)  # pop with default avoids KeyError check
+        self.pending_circuits.pop(circuit_id, None)  # pop with default avoids KeyError check
 
     def record_immediate_failure(self, first_hop, exit_relay, error_str):
         """
         Record a circuit that failed immediately (before getting a circuit_id).
         This happens when controller.new_circuit() throws an exception.
         """
+        first_hop = sys.intern(first_hop)
         self.failed_circuits += 1
-        self.failed_circuit_relays[exit_relay] = {
-            "reason_key": "circuit_creation_failed",
-            "error": "Tor Circuit Error: Failed to create circuit (%s)" % error_str,
-            "tor_reason": "CREATION_FAILED",
-            "first_hop": first_hop,
-            "timestamp": datetime.now().timestamp()
-        }
-        log.debug("Recorded immediate circuit failure for %s: %s" % (exit_relay[:8], error_str))
+        self._failure_reasons["circuit_creation_failed"] += 1
+        self._failure_first_hops[first_hop] += 1
+        # Keep the first failure recorded for an exit, as _circ_failed does.
+        if exit_relay not in self.failed_circuit_relays:
+            self.failed_circuit_relays[exit_relay] = FailedCircuit(
+                "circuit_creation_failed",
+                "Tor Circuit Error: Failed to create circuit (%s)" % error_str,
+                "CREATION_FAILED",
+                first_hop,
+                _now())
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Recorded immediate circuit failure for %s: %s", exit_relay[:8], error_str)
 
     def update_circs(self, circ_event):
         """
         Update statistics with the given circuit event.
         Uses the circuit registry to get the intended path.
         """
-        cid = str(circ_event.id)
-        status = circ_event.status
-
-        if status == CircStatus.FAILED:
-            log.debug("Circuit %s failed: %s" % (cid, circ_event.reason))
-            self.failed_circuits += 1
-            
-            first_hop, exit_relay = self.resolve_circuit(cid)
-            reason_key, error_msg = get_circuit_failure_info(circ_event.reason)
-            
-            if exit_relay:
-                self.failed_circuit_relays[exit_relay] = {
-                    "reason_key": reason_key,
-                    "error": error_msg,
-                    "tor_reason": str(circ_event.reason) if circ_event.reason else "UNKNOWN",
-                    "first_hop": first_hop,
-                    "timestamp": datetime.now().timestamp()
-                }
-                log.debug("Recorded failure for %s via %s: %s" % (
-                    exit_relay[:8], first_hop[:8] if first_hop else "?", reason_key))
-                if len(self.failed_circuit_relays) % 50 == 0:
-                    log.info("Captured %d circuit failures" % len(self.failed_circuit_relays))
-            else:
-                # Circuit not in registry - record as unresolved failure
-                # Use circuit ID as placeholder fingerprint to maintain count consistency
-                unresolved_key = "UNRESOLVED_%s" % cid
-                self.failed_circuit_relays[unresolved_key] = {
-                    "reason_key": reason_key,
-                    "error": error_msg,
-                    "tor_reason": str(circ_event.reason) if circ_event.reason else "UNKNOWN",
-                    "first_hop": None,
-                    "timestamp": datetime.now().timestamp(),
-                    "unresolved": True
-                }
-                log.debug("Circuit %s not in registry - recorded as unresolved failure" % cid)
-            
-            self.complete_circuit(cid)
-
-        elif status == CircStatus.BUILT:
-            self.successful_circuits += 1
-            self.complete_circuit(cid)
+        handler = self._circ_handlers.get(circ_event.status)
+        if handler is not None:
+            handler(circ_event)
+
+    def bulk_update_circs(self, circ_events):
+        """
+        Update statistics with each of the given circuit events, in order.
+        """
+        handlers_get = self._circ_handlers.get
+        for circ_event in circ_events:
+            handler = handlers_get(circ_event.status)
+            if handler is not None:
+                handler(circ_event)
+
+    def _circ_failed(self, circ_event):
+        """
+        Record a FAILED circuit event.
+        """
+        cid = circ_event.id
+        log.debug("Circuit %s failed: %s", cid, circ_event.reason)
+        self.failed_circuits += 1
+
+        # The event resolves the circuit, so look it up and remove it from
+        # the registry in one go.
+        info = self.pending_circuits.pop(cid, None)
+        first_hop, exit_relay = (info.first_hop, info.exit_relay) if info else (None, None)
+        reason_key, error_msg, tor_reason = get_circuit_failure_info(
+            circ_event.reason)
+        self._failure_reasons[reason_key] += 1
+        if first_hop:
+            self._failure_first_hops[first_hop] += 1
+
+        if exit_relay:
+            self._resolved_count += 1
+            # Keep the first failure recorded for an exit.  The circuit
+            # counter above still counts every event, since
+            # EventHandler.check_finished compares it to total_circuits.
+            if exit_relay not in self.failed_circuit_relays:
+                self.failed_circuit_relays[exit_relay] = FailedCircuit(
+                    reason_key, error_msg, tor_reason, first_hop, _now())
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Recorded failure for %s via %s: %s",
+                          exit_relay[:8], first_hop[:8] if first_hop else "?", reason_key)
+            self._failure_log_count += 1
+            if self._failure_log_count % 50 == 0:
+                log.info("Captured %d circuit failures", self._failure_log_count)
+        else:
+            # Circuit not in registry - record as unresolved failure
+            self._unresolved_count += 1
+            self.unresolved_failures.append(FailedCircuit(
+                reason_key, error_msg, tor_reason, None, _now(), True))
+            log.debug("Circuit %s not in registry - recorded as unresolved failure", cid)
+            self._check_unresolved_ratio()
+
+    def _circ_built(self, circ_event):
+        """
+        Record a BUILT circuit event.
+        """
+        self.successful_circuits += 1
+        self.pending_circuits.pop(circ_event.id, None)
+
+    def _check_unresolved_ratio(self):
+        """
+        Warn once if a large share of failed circuits is not in the registry.
+        """
+
+        if self._unresolved_warned:
+            return
+        failures = self._resolved_count + self._unresolved_count
+        if failures < UNRESOLVED_MIN_FAILURES:
+            return
+        if self._unresolved_count > failures * UNRESOLVED_WARN_RATIO:
+            self._unresolved_warned = True
+            log.warning("%d out of %d failed circuits could not be mapped to "
+                        "an exit relay.  Are circuit events being dropped?",
+                        self._unresolved_count, failures)
 
     def get_failed_circuit_relays(self):
         """
         Return the dictionary of failed circuit relays.
+
+        Values are FailedCircuit records; use `_asdict()` to serialise them.
         """
         return self.failed_circuit_relays
 
+    def get_unresolved_failures(self):
+        """
+        Return the list of failures that could not be mapped to an exit relay.
+        """
+        return self.unresolved_failures
+
+    def failure_breakdown(self, top_n=5):
+        """
+        Roll up circuit failure events for an end-of-scan summary.
+
+        Returns a tuple of a Counter of failure events per reason key, and a
+        list of the `top_n` first hops with the most failure events as
+        (fingerprint, count) pairs.  Every event counted in failed_circuits
+        is counted here, including repeated failures of the same exit;
+        failures whose first hop is unknown are left out of the ranking.
+        """
+
+        return (Counter(self._failure_reasons),
+                self._failure_first_hops.most_common(top_n))
+
     def print_progress(self, sampling=50):
         """
         Print statistics about ongoing probing process.
         """
 
-        if (sampling == 0) or (self.finished_streams % sampling):
+        if not sampling or self.finished_streams % sampling:
             return
 
-        if self.total_circuits == 0:
+        total = self.total_circuits
+        if not total:
             return
 
-        percent_done = (self.successful_circuits /
-                        float(self.total_circuits)) * 100
-
-        log.info("Probed %d out of %d exit relays, so we are %.2f%% done." %
-                 (self.successful_circuits, self.total_circuits, percent_done))
+        successful = self.successful_circuits
+        log.info("Probed %d out of %d exit relays, so we are %.2f%% done.",
+                 successful, total, successful * 100.0 / total)
 
     def __str__(self):
         """
         Print the gathered statistics.
+
+        The summary is reused for a short while as long as the counters it
+        reports have not changed.
         """
 
+        now = time.monotonic()
+        counters = (self.modules_run, self.failed_circuits, self.total_circuits)
+        cache = self._str_cache
+        if cache is not None and cache[0] == counters and \
+                now - cache[1] < _STR_CACHE_TTL:
+            return cache[2]
+
+        from datetime import timedelta
+
         percent = 0
         if self.total_circuits > 0:
             percent = (self.failed_circuits / float(self.total_circuits)) * 100
 
-        return ("Ran %d module(s) in %s and %d/%d circuits failed (%.2f%%)." %
-                (self.modules_run,
-                 str(datetime.now() - self.start_time),
-                 self.failed_circuits,
-                 self.total_circuits,
-                 percent))
+        summary = ("Ran %d module(s) in %s and %d/%d circuits failed (%.2f%%)." %
+                   (self.modules_run,
+                    str(timedelta(seconds=now - self._start_monotonic)),
+                    self.failed_circuits,
+                    self.total_circuits,
+                    percent))
+        self._str_cache = (counters, now, summary)
+        return summary
@@ -117,10 +117,11 @@ class _Torsocket(socks.socksocket):
         elif resp[1:2] != chr(0x00).encode():
             # Connection failed
             socks._BaseSocket.close(self)
-            if ord(resp[1:2])<=8:
-                raise error.SOCKSv5Error("SOCKS Server error {}".format(ord(resp[1:2])))
+            code = ord(resp[1:2])
+            if code<=8:
+                raise error.SOCKSv5Error("SOCKS Server error {}".format(code), code)
             else:
-                raise error.SOCKSv5Error("SOCKS Server error 9")
+                raise error.SOCKSv5Error("SOCKS Server error 9", 9)
         # Get the bound address/port
         elif resp[3:4] == chr(0x01).encode():
             ip = socket.inet_ntoa(socks._BaseSocket.recv(self, 4))
@@ -40,6 +40,13 @@ log = logging.getLogger(__name__)
 
 analysis_dir = None
 
+# Patterns matched against Tor's log output and stream events.
+
+_BOOTSTRAP_RE = re.compile(r"^.*(Bootstrapped \d+%.*)$")
+_SOCKS_PORT_RE = re.compile("Socks listener listening on port ([0-9]{1,5}).")
+_CONTROL_PORT_RE = re.compile("Control listener listening on port ([0-9]{1,5}).")
+_SOURCE_PORT_RE = re.compile(r"SOURCE_ADDR=[0-9\.]{7,15}:([0-9]{1,5})")
+
 
 def parse_log_lines(ports, log_line):
     """
@@ -50,18 +57,16 @@ def parse_log_lines(ports, log_line):
 
     log.debug("Tor says: %s" % log_line)
 
-    if re.search(r"^.*Bootstrapped \d+%.*$", log_line):
-        log.info(re.sub(r"^.*(Bootstrapped \d+%.*)$", r"Tor \1", log_line))
-
-    socks_pattern = "Socks listener listening on port ([0-9]{1,5})."
-    control_pattern = "Control listener listening on port ([0-9]{1,5})."
+    match = _BOOTSTRAP_RE.search(log_line)
+    if match:
+        log.info("Tor %s" % match.group(1))
 
-    match = re.search(socks_pattern, log_line)
+    match = _SOCKS_PORT_RE.search(log_line)
     if match:
         ports["socks"] = int(match.group(1))
         log.debug("Tor uses port %d as SOCKS port." % ports["socks"])
 
-    match = re.search(control_pattern, log_line)
+    match = _CONTROL_PORT_RE.search(log_line)
     if match:
         ports["control"] = int(match.group(1))
         log.debug("Tor uses port %d as control port." % ports["control"])
@@ -90,8 +95,7 @@ def get_source_port(stream_line):
     Extract the source port from a stream event.
     """
 
-    pattern = "SOURCE_ADDR=[0-9\.]{7,15}:([0-9]{1,5})"
-    match = re.search(pattern, stream_line)
+    match = _SOURCE_PORT_RE.search(stream_line)
 
     if match:
         return int(match.group(1))
@@ -4,12 +4,14 @@ import sys
 from unittest.mock import Mock
 
 import pytest
-from stem import descriptor
+from stem import Flag, descriptor
+
+_DATA_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data")
 
 
 @pytest.fixture(scope="session")
 def data_path():
-    return os.path.join(os.path.abspath(os.path.dirname(__file__)), "data")
+    return _DATA_PATH
 
 
 @pytest.fixture(scope="session")
@@ -70,17 +72,25 @@ def args(args_default, tor_dir):
     return namespace
 
 
+@pytest.fixture(scope="session")
+def args_localhost():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host')
+    parser.add_argument('--port')
+    return parser.parse_args(["--host", "localhost", "--port", "8000"])
+
+
 @pytest.fixture(scope="session")
 def cached_consensus_path(data_path):
     return os.path.join(data_path, "cached-consensus")
 
 
-@pytest.fixture()
+@pytest.fixture(scope="session")
 def cached_descriptors_path(data_path):
     return os.path.join(data_path, "cached-descriptors")
 
 
-@pytest.fixture()
+@pytest.fixture(scope="session")
 def cached_consensus(cached_consensus_path):
     # if imported on the top, the percent coverage of relayselector.py test
     # will be 0
@@ -90,12 +100,29 @@ def cached_consensus(cached_consensus_path):
     return cc
 
 
+@pytest.fixture(scope="session")
+def exit_policies(cached_descriptors_path):
+    import relayselector
+
+    return relayselector.get_exit_policies(cached_descriptors_path)
+
+
 @pytest.fixture(scope="session")
 def router_statuses(cached_consensus_path):
     network_statuses = descriptor.parse_file(cached_consensus_path)
     return list(network_statuses)
 
 
+@pytest.fixture(scope="session")
+def consensus_sizes(router_statuses):
+    # Counted from stem's own parse of the file rather than through
+    # relayselector, so the two can be checked against each other
+    return {
+        "total": len(router_statuses),
+        "exits": sum(1 for rs in router_statuses if Flag.EXIT in rs.flags),
+    }
+
+
 @pytest.fixture(scope="session")
 def controller(router_statuses):
     controller = Mock()
@@ -111,6 +138,20 @@ def modules():
     return exitmap.get_modules()
 
 
+@pytest.fixture(scope="session")
+def make_circ_event():
+    from stem.response.events import CircuitEvent
+
+    def _circ_event(status, circ_id="123", reason=None):
+        circ_event = CircuitEvent("foo", "bar")
+        circ_event.id = circ_id
+        circ_event.status = status
+        circ_event.reason = reason
+        return circ_event
+
+    return _circ_event
+
+
 @pytest.fixture(scope="function")
 def stats_obj():
     import stats
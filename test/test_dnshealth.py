@@ -29,18 +29,17 @@ Tests cover:
 - Environment variable configuration
 """
 
+import itertools
 import json
 import os
-import sys
 import time
 import socket
+from collections import Counter
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-sys.path.insert(0, 'src/')
-
-# Import after path setup
 from modules import dnshealth
 import error
 
@@ -49,34 +48,26 @@ import error
 
 @pytest.fixture
 def mock_exit_desc():
-    """Create a mock exit relay descriptor."""
-    desc = MagicMock()
-    desc.fingerprint = "ABCD1234EFGH5678IJKL9012MNOP3456QRST7890"
-    desc.nickname = "TestExitRelay"
-    desc.address = "192.0.2.1"
-    return desc
+    """Create a stand-in exit relay descriptor."""
+    return SimpleNamespace(
+        fingerprint="ABCD1234EFGH5678IJKL9012MNOP3456QRST7890",
+        nickname="TestExitRelay",
+        address="192.0.2.1",
+    )
 
 
 @pytest.fixture
 def mock_exit_desc_minimal():
-    """Create a minimal mock exit descriptor (missing optional fields)."""
-    desc = MagicMock(spec=['fingerprint'])
-    desc.fingerprint = "MINIMAL1234567890123456789012345678901234"
+    """Create a minimal exit descriptor (missing optional fields)."""
     # nickname and address not set - should use defaults
-    del desc.nickname
-    del desc.address
-    return desc
+    return SimpleNamespace(fingerprint="MINIMAL1234567890123456789012345678901234")
 
 
 @pytest.fixture(autouse=True)
-def reset_module_state():
-    """Reset module state before each test."""
-    dnshealth._run_id = None
-    dnshealth._status_counts.clear()
-    yield
-    # Cleanup after test
-    dnshealth._run_id = None
-    dnshealth._status_counts.clear()
+def reset_module_state(monkeypatch):
+    """Give each test fresh module state; monkeypatch restores it after."""
+    monkeypatch.setattr(dnshealth, "_run_id", None)
+    monkeypatch.setattr(dnshealth, "_status_counts", Counter())
 
 
 @pytest.fixture
@@ -101,6 +92,8 @@ def mock_torsocket():
                 result = dnshealth.resolve_with_retry(...)
     """
     mock_socket = MagicMock()
+    # torsocket() is used as a context manager yielding the socket itself
+    mock_socket.__enter__.return_value = mock_socket
     
     def use_socket():
         return patch.object(dnshealth.torsocks, 'torsocket', return_value=mock_socket)
@@ -114,16 +107,17 @@ class TestGenerateUniqueQuery:
     """Tests for the unique DNS query generation."""
 
     def test_format_structure(self):
-        """Query should have format: {uuid}.{fp_prefix}.{base_domain}"""
+        """Query should have format: {token}.{fp_prefix}.{base_domain}"""
         query = dnshealth.generate_unique_query(
             "ABCD1234EFGH5678",
             "example.com"
         )
         parts = query.split(".")
 
-        # Should be: uuid.fp_prefix.example.com
+        # Should be: token.fp_prefix.example.com
         assert len(parts) == 4
-        assert len(parts[0]) == 32  # UUID hex is 32 chars
+        assert len(parts[0]) == 26  # Base32 128-bit token is 26 chars
+        assert parts[0] == parts[0].lower()
         assert parts[1] == "abcd1234"  # First 8 chars lowercase
         assert parts[2] == "example"
         assert parts[3] == "com"
@@ -135,17 +129,26 @@ class TestGenerateUniqueQuery:
         assert parts[1] == "uppercas"  # First 8 chars, lowercased
 
     def test_uniqueness_same_fingerprint(self):
-        """Same fingerprint should generate unique queries (UUID differs)."""
+        """Same fingerprint should generate unique queries (token differs)."""
         fp = "SAMEFP1234567890"
         q1 = dnshealth.generate_unique_query(fp, "example.com")
         q2 = dnshealth.generate_unique_query(fp, "example.com")
 
-        # Full queries should differ (UUIDs differ)
+        # Full queries should differ (tokens differ)
         assert q1 != q2
 
         # But fingerprint prefixes should be same
         assert q1.split(".")[1] == q2.split(".")[1]
 
+    def test_uniqueness_across_processes(self, monkeypatch):
+        """Forked probes share the counter state but not the process ID."""
+        queries = set()
+        for pid in (1000, 1001):
+            monkeypatch.setattr(dnshealth, "_query_counter", itertools.count())
+            monkeypatch.setattr(dnshealth.os, "getpid", lambda pid=pid: pid)
+            queries.add(dnshealth.generate_unique_query("AAAAAAAA", "example.com"))
+        assert len(queries) == 2
+
     def test_different_fingerprints(self):
         """Different fingerprints should have different prefixes."""
         q1 = dnshealth.generate_unique_query("AAAAAAAA", "example.com")
@@ -357,6 +360,27 @@ class TestParseSocksErrorCode:
         assert dnshealth._parse_socks_error_code("Error 4") == 4
 
 
+# === Test: _socks_error_code ===
+
+class TestSocksErrorCode:
+    """Tests for SOCKS error code lookup on exceptions."""
+
+    def test_code_attribute_used(self):
+        """Reply code attached to the exception should be used directly."""
+        err = error.SOCKSv5Error("SOCKS Server error 4", 4)
+        assert dnshealth._socks_error_code(err) == 4
+
+    def test_out_of_range_code_returns_none(self):
+        """Reply codes outside 1-8 should return None."""
+        err = error.SOCKSv5Error("SOCKS Server error 9", 9)
+        assert dnshealth._socks_error_code(err) is None
+
+    def test_falls_back_to_message(self):
+        """Exceptions without a reply code should be parsed from the message."""
+        err = error.SOCKSv5Error("error 5: connection refused")
+        assert dnshealth._socks_error_code(err) == 5
+
+
 # === Test: _normalize_ip ===
 
 class TestNormalizeIp:
@@ -386,7 +410,7 @@ class TestElapsedMs:
 
     def test_positive_elapsed_time(self):
         """Should calculate positive elapsed time in milliseconds."""
-        start = time.time() - 1.5  # 1.5 seconds ago
+        start = time.monotonic_ns() - 1_500_000_000  # 1.5 seconds ago
         elapsed = dnshealth._elapsed_ms(start)
 
         # Should be around 1500ms (allow some variance)
@@ -394,7 +418,7 @@ class TestElapsedMs:
 
     def test_returns_integer(self):
         """Should return an integer."""
-        start = time.time()
+        start = time.monotonic_ns()
         elapsed = dnshealth._elapsed_ms(start)
 
         assert isinstance(elapsed, int)
@@ -508,6 +532,20 @@ class TestWriteResult:
 
         assert loaded == result
 
+    def test_json_content_valid_with_orjson(self, mock_exit_desc, temp_analysis_dir):
+        """orjson, if installed, writes bytes that load back as the result."""
+        fake_orjson = MagicMock()
+        fake_orjson.dumps.side_effect = lambda obj: json.dumps(obj).encode()
+        result = {"test": "data", "number": 123}
+
+        with patch.object(dnshealth, "orjson", fake_orjson):
+            dnshealth._write_result(result, mock_exit_desc.fingerprint)
+
+        fake_orjson.dumps.assert_called_once_with(result)
+        expected_path = temp_analysis_dir / f"dnshealth_{mock_exit_desc.fingerprint}.json"
+        with open(expected_path, "rb") as f:
+            assert json.loads(f.read()) == result
+
     def test_no_write_without_analysis_dir(self, mock_exit_desc):
         """Should not write if analysis_dir is not set."""
         import util
@@ -553,7 +591,7 @@ class TestResolveWithRetry:
         """NXDOMAIN should be success in NXDOMAIN mode."""
         dnshealth.setup()
         mock_socket, use_socket = mock_torsocket
-        mock_socket.resolve.side_effect = error.SOCKSv5Error("error 4: domain not found")
+        mock_socket.resolve.side_effect = error.SOCKSv5Error("SOCKS Server error 4", 4)
 
         with use_socket():
             result = dnshealth.resolve_with_retry(
@@ -566,7 +604,7 @@ class TestResolveWithRetry:
         """NXDOMAIN should be failure in wildcard mode."""
         dnshealth.setup()
         mock_socket, use_socket = mock_torsocket
-        mock_socket.resolve.side_effect = error.SOCKSv5Error("error 4: domain not found")
+        mock_socket.resolve.side_effect = error.SOCKSv5Error("SOCKS Server error 4", 4)
 
         with use_socket():
             result = dnshealth.resolve_with_retry(
@@ -591,7 +629,7 @@ class TestResolveWithRetry:
         dnshealth.setup()
         mock_socket, use_socket = mock_torsocket
         mock_socket.resolve.side_effect = [
-            error.SOCKSv5Error("error 1: general failure"),
+            error.SOCKSv5Error("SOCKS Server error 1", 1),
             "64.65.4.1"
         ]
 
@@ -612,7 +650,7 @@ class TestResolveWithRetry:
             dnshealth.resolve_with_retry(
                 mock_exit_desc, "test.example.com", expected_ip="64.65.4.1", retries=1)
 
-        mock_socket.close.assert_called()
+        mock_socket.__exit__.assert_called()
 
     def test_timing_recorded(self, mock_exit_desc, mock_torsocket):
         """Timing should be recorded as a dict."""
@@ -658,6 +696,24 @@ class TestDoValidation:
         expected_path = temp_analysis_dir / f"dnshealth_{mock_exit_desc.fingerprint}.json"
         assert expected_path.exists()
 
+    def test_hard_timeout_result(self, mock_exit_desc, temp_analysis_dir):
+        """Hard timeout should be recorded in the in-progress result."""
+        dnshealth.setup()
+
+        with patch.object(dnshealth, 'resolve_with_retry',
+                          side_effect=dnshealth.HardTimeoutError()):
+            dnshealth.do_validation(mock_exit_desc, "test.example.com", "64.65.4.1")
+
+        expected_path = temp_analysis_dir / f"dnshealth_{mock_exit_desc.fingerprint}.json"
+        with open(expected_path) as f:
+            result = json.load(f)
+
+        assert result["status"] == "hard_timeout"
+        assert result["exit_nickname"] == mock_exit_desc.nickname
+        assert result["attempt"] == dnshealth.MAX_RETRIES
+        assert result["timing"]["total_ms"] == dnshealth.HARD_TIMEOUT * 1000
+        assert dnshealth._status_counts["hard_timeout"] == 1
+
 
 # === Test: probe ===
 
@@ -715,6 +771,41 @@ class TestProbe:
         assert expected_ip is None
 
 
+# === Test: _write_circuit_failures ===
+
+class TestWriteCircuitFailures:
+    """Tests for circuit failure output."""
+
+    def test_writes_failures_and_stats(self, temp_analysis_dir, make_circ_event):
+        """Resolved failures should be written, unresolved ones only counted."""
+        import stats
+        from stem import CircStatus
+
+        dnshealth.setup()
+        scan = stats.Statistics()
+        scan.total_circuits = 3
+        scan.register_circuit("1", "A" * 40, "B" * 40)
+        scan.record_immediate_failure("A" * 40, "C" * 40, "boom")
+        for cid in ("1", "2"):
+            scan.update_circs(make_circ_event(CircStatus.FAILED, cid, "TIMEOUT"))
+
+        assert dnshealth._write_circuit_failures(scan) == 3
+
+        with open(temp_analysis_dir / "scan_stats.json") as f:
+            scan_stats = json.load(f)
+        assert scan_stats["failed_circuits"] == 3
+        assert scan_stats["resolved_failures"] == 2
+        assert scan_stats["unresolved_failures"] == 1
+
+        with open(temp_analysis_dir / "circuit_failures.json") as f:
+            failures = {f["exit_fingerprint"]: f for f in json.load(f)}
+        assert set(failures) == {"B" * 40, "C" * 40}
+        assert failures["B" * 40]["circuit_reason"] == "circuit_timeout"
+        assert failures["B" * 40]["first_hop"] == "A" * 40
+        assert failures["C" * 40]["tor_reason"] == "CREATION_FAILED"
+        assert abs(failures["B" * 40]["timestamp"] - time.time()) < 60
+
+
 # === Test: teardown ===
 
 class TestTeardown:
@@ -794,11 +885,22 @@ class TestHardTimeout:
             pytest.skip("SIGALRM not available on this platform")
 
         with dnshealth._AlarmContext(10):
-            # Inside context, alarm should be set
-            pass
+            # Inside context, the timer should be armed
+            assert signal.getitimer(signal.ITIMER_REAL)[0] > 0
+
+        # After context, the timer should be cleared (no pending alarm)
+        assert signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0)
+
+    def test_alarm_context_fractional_timeout(self):
+        """Sub-second timeouts should interrupt the probe."""
+        import signal
+
+        if not hasattr(signal, 'SIGALRM'):
+            pytest.skip("SIGALRM not available on this platform")
 
-        # After context, alarm should be cleared (no pending alarm)
-        # Just verify no exception was raised
+        with pytest.raises(dnshealth.HardTimeoutError):
+            with dnshealth._AlarmContext(0.05):
+                time.sleep(5)
 
 
 # === Test: Main guard ===
@@ -1,11 +1,21 @@
-import argparse
-import sys
+import importlib
+import logging
+import logging.handlers
 import time
 import warnings
-# hacky, until exitmap is an installable package
-sys.path.insert(0, 'src/')  # noqa
+
+import pytest
+
 import exitmap
 
+# Destinations when --host localhost --port 8000 are given
+EXPECTED_DESTS = frozenset({('127.0.0.1', '8000')})
+
+# Modules whose `destinations` is None: they pick their own targets, so the
+# command line host and port are not used
+NO_DESTINATION_MODULES = {"dnshealth", "dnspoison", "dnsresolution", "dnssec",
+                          "rtt"}
+
 
 def test_get_modules():
     modules = exitmap.get_modules()
@@ -22,17 +32,23 @@ def test_get_modules():
         assert m in modules
 
 
-def test_lookup_destinations():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--host')
-    parser.add_argument('--port')
-    args = parser.parse_args(["--host", "localhost", "--port", "8000"])
-    destinations = exitmap.lookup_destinations(args, "checktest.destinations")
-    # Testing only `checktest` to do not take too long
-    for module in ["checktest"]:  # exitmap.get_modules():
-        print(module)
-        destinations = exitmap.lookup_destinations(args, module)
-        assert destinations == {('127.0.0.1', '8000')}
+def test_get_modules_cached():
+    assert exitmap.get_modules() is exitmap.get_modules()
+
+
+@pytest.mark.parametrize("name", exitmap.get_modules())
+def test_lookup_destinations(args_localhost, name):
+    module = importlib.import_module("modules." + name)
+    destinations = exitmap.lookup_destinations(args_localhost, module)
+    if name in NO_DESTINATION_MODULES:
+        assert destinations == frozenset()
+    else:
+        assert destinations == EXPECTED_DESTS
+
+
+def test_lookup_destinations_cached(args_localhost):
+    destinations = exitmap.lookup_destinations(args_localhost, "checktest")
+    assert exitmap.lookup_destinations(args_localhost, "checktest") is destinations
 
 
 def test_parser_cmd_args(mock_argv, args_default):
@@ -68,3 +84,23 @@ def test_sleep(args):
     delta = stop - start
     assert delta >= test_delay * 0.9  # Allow 10% tolerance
     assert delta < test_delay + 0.5   # Should not take too long
+
+
+def test_log_via_queue(monkeypatch):
+    root = logging.getLogger()
+    capture = logging.handlers.BufferingHandler(capacity=10)
+    monkeypatch.setattr(root, "handlers", [capture])
+    # Collect the hooks instead of registering them for the whole test run
+    at_exit, at_fork = [], []
+    monkeypatch.setattr(exitmap.atexit, "register", at_exit.append)
+    monkeypatch.setattr(exitmap.os, "register_at_fork",
+                        lambda after_in_child: at_fork.append(after_in_child))
+
+    exitmap._log_via_queue()
+    assert isinstance(root.handlers[0], logging.handlers.QueueHandler)
+    root.warning("queued record")
+    at_exit[0]()  # Stops the listener once the queue is drained
+    assert [r.getMessage() for r in capture.buffer] == ["queued record"]
+
+    at_fork[0]()  # What a forked child runs
+    assert root.handlers == [capture]
@@ -20,8 +20,6 @@
 """ Unit tests for the relay selector module."""
 
 import unittest
-import sys
-sys.path.insert(0, 'src/')
 import relayselector
 from stem import exit_policy
 
@@ -43,8 +41,19 @@ class TestRelaySelector(unittest.TestCase):
         self.assertEqual(exits.exception.code, 1)
 
 
-def test_get_exit_policies(cached_descriptors_path):
-    exit_policies = relayselector.get_exit_policies(cached_descriptors_path)
+def test_select_exits_without_candidates():
+    assert relayselector._select_exits({}, {}, country_code='at') == {}
+
+
+def test_select_exits_requested(cached_consensus):
+    fpr = "50485E03CA39D393BD54D315CEBA65E6DD0FDDB9"
+    exits = relayselector._select_exits(cached_consensus, {},
+                                        requested_exits=[fpr])
+    assert list(exits) == [fpr]
+    assert ("192.0.2.1", 443) in exits[fpr]
+
+
+def test_get_exit_policies(exit_policies):
     assert isinstance(
         exit_policies["9C67E543354ED18B7FF00E080AC086762035119C"].exit_policy,
         exit_policy.ExitPolicy
@@ -55,22 +64,38 @@ def test_get_exit_policies(cached_descriptors_path):
     )
 
 
-def test_get_cached_consensus(cached_consensus_path):
+def test_consensus_sizes(consensus_sizes):
+    # The test data is a fixed snapshot of the consensus
+    assert consensus_sizes == {"total": 7587, "exits": 2297}
+
+
+def test_get_cached_consensus(cached_consensus_path, consensus_sizes):
     cc = relayselector.get_cached_consensus(cached_consensus_path)
     assert isinstance(cc, dict)
-    assert 7587 == len(cc)
+    assert len(cc) == consensus_sizes["total"]
 
 
-def test_get_fingerprints(cached_consensus_path):
+def test_get_cached_consensus_memoized(cached_consensus_path):
+    cc = relayselector.get_cached_consensus(cached_consensus_path)
+    assert relayselector.get_cached_consensus(cached_consensus_path) is cc
+
+
+def test_get_fingerprints(cached_consensus_path, consensus_sizes):
     fps = relayselector.get_fingerprints(cached_consensus_path, exclude=[])
     assert isinstance(fps, list)
-    assert 7587 == len(fps)
+    assert len(fps) == consensus_sizes["total"]
+
+
+def test_get_fingerprints_parsed_consensus(cached_consensus,
+                                           cached_consensus_path):
+    fps = relayselector.get_fingerprints(cached_consensus)
+    assert fps == relayselector.get_fingerprints(cached_consensus_path)
 
 
-def test_router_statuses_with_exit_flag(cached_consensus):
+def test_router_statuses_with_exit_flag(cached_consensus, consensus_sizes):
     rs = relayselector.router_statuses_with_exit_flag(cached_consensus)
     assert isinstance(rs, dict)
-    assert 2297 == len(rs)
+    assert len(rs) == consensus_sizes["exits"]
 
 
 if __name__ == '__main__':
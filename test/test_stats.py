@@ -21,53 +21,136 @@
 Implements unit tests.
 """
 
-import unittest
-import stem.control
+import pytest
 from stem import CircStatus
-import sys
-sys.path.insert(0, 'src/')
 import stats
 
 
-class TestStats(unittest.TestCase):
-    """Test the stats module."""
+# Built once per module; tests must not modify them
+@pytest.fixture(scope="module")
+def failed_circ_event(make_circ_event):
+    return make_circ_event(CircStatus.FAILED, reason="foo")
 
-    def setUp(self):
-        self.stats = stats.Statistics()
 
-    def test_stats(self):
-        self.stats.print_progress(sampling=0)
-        self.stats.print_progress
-        self.assertTrue(str(self.stats))
+@pytest.fixture(scope="module")
+def built_circ_event(make_circ_event):
+    return make_circ_event(CircStatus.BUILT)
 
-        circ_event = stem.response.events.CircuitEvent("foo", "bar")
-        circ_event.id = "123"
-        circ_event.status = CircStatus.FAILED
-        circ_event.reason = "foo"
 
-        self.stats.update_circs(circ_event)
-        self.assertEqual(self.stats.failed_circuits, 1)
+def test_stats(stats_obj, failed_circ_event, built_circ_event):
+    stats_obj.print_progress(sampling=0)
+    assert stats_obj.total_circuits == 0
 
-        circ_event.status = CircStatus.BUILT
+    stats_obj.update_circs(failed_circ_event)
+    assert stats_obj.failed_circuits == 1
 
-        self.stats.update_circs(circ_event)
-        self.assertEqual(self.stats.successful_circuits, 1)
+    stats_obj.update_circs(built_circ_event)
+    assert stats_obj.successful_circuits == 1
+
+
+def test_stats_bulk_update_circs(stats_obj, make_circ_event, failed_circ_event,
+                                 built_circ_event):
+    extended = make_circ_event(CircStatus.EXTENDED)
+    stats_obj.bulk_update_circs([failed_circ_event, built_circ_event, extended])
+    assert stats_obj.failed_circuits == 1
+    assert stats_obj.successful_circuits == 1
 
 
 def test_stats_print_progress(caplog, stats_obj):
     stats_obj.total_circuits = 1
     stats_obj.finished_streams = 1
     stats_obj.print_progress(1)
-    print(stats_obj.__dict__)
     assert (
         "Probed 0 out of 1 exit relays, so we are 0.00% done." in caplog.text
     )
 
 
+def test_stats_circuit_registry(stats_obj, make_circ_event):
+    stats_obj.register_circuit("7", "A" * 40, "B" * 40)
+    assert stats_obj.resolve_circuit("7") == ("A" * 40, "B" * 40)
+
+    stats_obj.update_circs(make_circ_event(CircStatus.FAILED, "7", "TIMEOUT"))
+
+    assert stats_obj.resolve_circuit("7") == (None, None)
+    failure = stats_obj.get_failed_circuit_relays()["B" * 40]
+    assert failure.reason_key == "circuit_timeout"
+    assert failure.first_hop == "A" * 40
+
+
+def test_stats_repeated_exit_failure(stats_obj, make_circ_event):
+    for cid, reason in (("1", "TIMEOUT"), ("2", "DESTROYED")):
+        stats_obj.register_circuit(cid, "A" * 40, "B" * 40)
+        stats_obj.update_circs(make_circ_event(CircStatus.FAILED, cid, reason))
+
+    assert stats_obj.failed_circuits == 2
+    failures = stats_obj.get_failed_circuit_relays()
+    assert list(failures) == ["B" * 40]
+    assert failures["B" * 40].reason_key == "circuit_timeout"
+
+
+def test_stats_failure_breakdown(stats_obj, make_circ_event):
+    for cid, reason in (("1", "TIMEOUT"), ("2", "TIMEOUT"), ("3", "DESTROYED"),
+                        ("4", "TIMEOUT")):
+        if cid != "4":
+            stats_obj.register_circuit(cid, "A" * 40, cid * 40)
+        stats_obj.update_circs(make_circ_event(CircStatus.FAILED, cid, reason))
+
+    reasons, first_hops = stats_obj.failure_breakdown()
+    assert reasons == {"circuit_timeout": 3, "circuit_destroyed": 1}
+    assert first_hops == [("A" * 40, 3)]
+
+
+def test_stats_failure_breakdown_counts_events(stats_obj, make_circ_event):
+    for cid in ("1", "2", "3"):
+        stats_obj.register_circuit(cid, "A" * 40, "B" * 40)
+        stats_obj.update_circs(make_circ_event(CircStatus.FAILED, cid, "TIMEOUT"))
+    stats_obj.record_immediate_failure("A" * 40, "B" * 40, "boom")
+
+    reasons, first_hops = stats_obj.failure_breakdown()
+    assert sum(reasons.values()) == stats_obj.failed_circuits == 4
+    assert reasons == {"circuit_timeout": 3, "circuit_creation_failed": 1}
+    assert first_hops == [("A" * 40, 4)]
+    assert stats_obj.get_failed_circuit_relays()["B" * 40].reason_key == \
+        "circuit_timeout"
+
+
+def test_get_circuit_failure_info():
+    assert stats.get_circuit_failure_info("TIMEOUT") == (
+        "circuit_timeout", "Tor Circuit Error: Construction timed out", "TIMEOUT")
+    assert stats.get_circuit_failure_info("timeout") == (
+        "circuit_timeout", "Tor Circuit Error: Construction timed out", "TIMEOUT")
+    assert stats.get_circuit_failure_info(None)[2] == "UNKNOWN"
+    key, msg, tor_reason = stats.get_circuit_failure_info("bogus")
+    assert key == "circuit_failed"
+    assert msg.endswith("(BOGUS)")
+    assert tor_reason == "BOGUS"
+
+
+def test_stats_circuit_registry_bounded():
+    s = stats.Statistics(max_registered=2)
+    for cid in ("1", "2", "3"):
+        s.register_circuit(cid, "A" * 40, "B" * 40)
+    assert list(s.pending_circuits) == ["2", "3"]
+    assert s.resolve_circuit("1") == (None, None)
+
+
+def test_stats_unresolved_warning(caplog, stats_obj, make_circ_event):
+    for cid in range(stats.UNRESOLVED_MIN_FAILURES):
+        stats_obj.update_circs(
+            make_circ_event(CircStatus.FAILED, str(cid), "TIMEOUT"))
+
+    assert caplog.text.count("could not be mapped to an exit relay") == 1
+    assert len(stats_obj.get_unresolved_failures()) == stats.UNRESOLVED_MIN_FAILURES
+    assert stats_obj.get_failed_circuit_relays() == {}
+
+
 def test_stats_str(stats_obj):
     s = str(stats_obj)
     assert " and 0/0 circuits failed (0.00%)." in s
 
 
-if __name__ == '__main__':
-    unittest.main()
+def test_stats_str_reflects_changes(stats_obj):
+    str(stats_obj)
+    stats_obj.total_circuits = 4
+    stats_obj.failed_circuits = 1
+    assert " and 1/4 circuits failed (25.00%)." in str(stats_obj)
@@ -21,11 +21,9 @@
 
 import unittest
 import socket
-import sys
 
 import pytest
 
-sys.path.insert(0, 'src/')
 import torsocks
 
 
@@ -48,6 +46,23 @@ def test_torsocket():
     assert isinstance(ts, torsocks._Torsocket)
 
 
+@pytest.mark.parametrize("reply_code, expected", [(4, 4), (1, 1), (0x5b, 9)])
+def test_resolve_error_code(monkeypatch, reply_code, expected):
+    monkeypatch.setattr(torsocks._Torsocket, "negotiate", lambda self: None)
+    monkeypatch.setattr(torsocks, "send_queue", lambda sock_name: None)
+    monkeypatch.setattr(torsocks.socks._BaseSocket, "getsockname",
+                        lambda self: ("127.0.0.1", 38662))
+    monkeypatch.setattr(torsocks.socks._BaseSocket, "sendall",
+                        lambda self, data: None)
+    monkeypatch.setattr(torsocks.socks._BaseSocket, "recv",
+                        lambda self, size: bytes([0x05, reply_code, 0x00, 0x01]))
+    monkeypatch.setattr(torsocks.socks._BaseSocket, "close", lambda self: None)
+
+    with pytest.raises(torsocks.error.SOCKSv5Error) as excinfo:
+        torsocks._Torsocket().resolve("example.com")
+    assert excinfo.value.code == expected
+
+
 def test_getaddrinfo():
     args = ("check.torproject.org", 443)
     addr = torsocks.getaddrinfo(*args)
@@ -23,8 +23,6 @@ Implements unit tests.
 
 import os
 import unittest
-import sys
-sys.path.insert(0, 'src/')
 import util
 
 
@@ -110,7 +108,6 @@ def test_dump_to_file(tmp_path):
     blurb = b"foo"
     exit_fpr = "50485E03CA39D393BD54D315CEBA65E6DD0FDDB9"
     fn = util.dump_to_file(blurb, exit_fpr)
-    print(fn)
     assert os.path.isfile(fn)
 
 